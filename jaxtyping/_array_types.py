@@ -27,7 +27,7 @@ from typing import Any, Literal, NoReturn, Optional, Union
 
 import numpy as np
 
-from ._decorator import storage
+from ._decorator import _memo_state_var
 
 
 try:
@@ -198,10 +198,12 @@ class _MetaAbstractArray(type):
             if not in_dtypes:
                 return False
 
-        no_temp_memo = hasattr(storage, "memo_stack") and len(storage.memo_stack) != 0
+        state = _memo_state_var.get(None)
+        memo_stack = None if state is None else state[0]
+        no_temp_memo = memo_stack is not None and len(memo_stack) != 0
 
         if no_temp_memo:
-            single_memo, variadic_memo, variadic_broadcast_memo = storage.memo_stack[-1]
+            single_memo, variadic_memo, variadic_broadcast_memo = memo_stack[-1]
             # Make a copy so we don't mutate the original memo during the shape check.
             single_memo = single_memo.copy()
             variadic_memo = variadic_memo.copy()
@@ -217,7 +219,7 @@ class _MetaAbstractArray(type):
         if cls._check_shape(obj, single_memo, variadic_memo, variadic_broadcast_memo):
             # We update the memo every time we successfully pass a shape check
             if no_temp_memo:
-                storage.memo_stack[-1] = (
+                memo_stack[-1] = (
                     single_memo,
                     variadic_memo,
                     variadic_broadcast_memo,
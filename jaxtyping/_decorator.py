@@ -18,12 +18,13 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import dataclasses
-import functools as ft
 import inspect
-import textwrap
-import threading
+import operator
+import os
+import sys
 import types
 import weakref
+from contextvars import ContextVar
 from typing import get_args, get_origin
 
 
@@ -35,10 +36,47 @@ else:
     traceback_util.register_exclusion(__file__)
 
 
-storage = threading.local()
-
-
-_jaxtyped_fns = weakref.WeakSet()
+# `ContextVar.get` is implemented in C, so this is cheaper to access on every call to
+# a `jaxtyped`-decorated function than an attribute lookup on a `threading.local`.
+# One variable holds a `(memo_stack, frame_pool)` pair, so that each call crosses the
+# ContextVar machinery once rather than twice. The frame pool recycles popped memo
+# frames (cleared on pop), rather than allocating three fresh dicts plus the tuple
+# holding them on every call.
+_memo_state_var: ContextVar[tuple] = ContextVar("jaxtyping_memo_state")
+
+# Bound methods hoisted to module level, so that `wrapped_fn` skips the attribute
+# lookups on its hot path. (We stay pure Python -- this package ships no compiled
+# extensions -- so the wrapper's bytecode is worth keeping tight.)
+_get_memo_state = _memo_state_var.get
+_set_memo_state = _memo_state_var.set
+
+
+# Analogous to how `assert` statements respect `-O`: when running optimised, or when
+# explicitly asked to via the environment, skip runtime checking altogether.
+_disabled = bool(sys.flags.optimize) or os.environ.get("JAXTYPING_DISABLE", "0") != "0"
+
+
+def _fast_wraps(wrapper, fn):
+    # A cut-down `functools.wraps`. That copies six-plus attributes (including a
+    # `__dict__` update) per decoration, which adds up when the import hook decorates
+    # every function in a package. Only the attributes needed for introspection and
+    # for typecheckers (which follow `__wrapped__`) are copied here.
+    wrapper.__wrapped__ = fn
+    # As in `functools.wraps`, missing attributes are skipped: `fn` may be a slot
+    # wrapper such as `object.__init__` (e.g. from a `dataclass(init=False)`), which
+    # has no `__module__`.
+    for attr in ("__module__", "__name__", "__qualname__", "__doc__"):
+        try:
+            value = getattr(fn, attr)
+        except AttributeError:
+            pass
+        else:
+            setattr(wrapper, attr, value)
+    # `functools.wraps` picked this up via its `__dict__` update; the `abc` machinery
+    # needs it preserved.
+    if getattr(fn, "__isabstractmethod__", False):
+        wrapper.__isabstractmethod__ = True
+    return wrapper
 
 
 def jaxtyped(fn):
@@ -84,69 +122,272 @@ def jaxtyped(fn):
     Only `isinstance` checks that pass will contribute to the store of axis name-size
     pairs; those that fail will not. As such it is safe to write e.g.
     `assert not isinstance(x, Float32[Array, "foo"])`.
+
+    `jaxtyped` becomes the identity function when running under `python -O` (more
+    precisely, whenever `sys.flags.optimize` is set), or when the environment
+    variable `JAXTYPING_DISABLE` is set to anything other than `0`.
     """
-    if type(fn) is types.FunctionType and fn in _jaxtyped_fns:
+    if _disabled:
         return fn
-    elif inspect.isclass(fn):  # allow decorators on class definitions
-        if dataclasses.is_dataclass(fn):
-            init = jaxtyped(fn.__init__)
-            fn.__init__ = init
-            return fn
-        else:
-            raise ValueError(
-                "jaxtyped may only be added as a class decorator to dataclasses"
-            )
-    # It'd be lovely if we could handle arbitrary descriptors, and not just the builtin
-    # ones. Unfortunately that means returning a class instance with a __get__ method,
-    # and that turns out to break loads of other things. See beartype issue #211 and
-    # jaxtyping issue #71.
+    # Exact-type dispatch first: when the import hook decorates every function in a
+    # package then this is on the critical path at import time, and a single dict
+    # lookup is cheaper than a chain of `isinstance` checks.
+    handler = _handlers.get(type(fn))
+    if handler is not None:
+        return handler(fn)
+    # Fall back to `isinstance` for subclasses (and for classes, whose metaclass may
+    # be anything).
+    if isinstance(fn, type):
+        return _wrap_class(fn)
     elif isinstance(fn, classmethod):
-        return classmethod(jaxtyped(fn.__func__))
+        return _wrap_classmethod(fn)
     elif isinstance(fn, staticmethod):
-        return staticmethod(jaxtyped(fn.__func__))
+        return _wrap_staticmethod(fn)
     elif isinstance(fn, property):
-        if fn.fget is None:
-            fget = None
-        else:
-            fget = jaxtyped(fn.fget)
-        if fn.fset is None:
-            fset = None
-        else:
-            fset = jaxtyped(fn.fset)
-        if fn.fdel is None:
-            fdel = None
-        else:
-            fdel = jaxtyped(fn.fdel)
-        return property(fget=fget, fset=fset, fdel=fdel)
+        return _wrap_property(fn)
     else:
+        return _wrap_function(fn)
 
-        @ft.wraps(fn)
-        def wrapped_fn(*args, **kwargs):
-            try:
-                memo_stack = storage.memo_stack
-            except AttributeError:
-                memo_stack = storage.memo_stack = []
-            memo_stack.append(({}, {}, {}))
-            try:
-                return fn(*args, **kwargs)
-            finally:
-                memo_stack.pop()
 
-        _jaxtyped_fns.add(wrapped_fn)
-        return wrapped_fn
+def _wrap_class(kls):  # allow decorators on class definitions
+    # `hasattr` rather than `dataclasses.is_dataclass`, which is a Python-level
+    # function doing the same attribute lookup.
+    if hasattr(kls, "__dataclass_fields__"):
+        init = jaxtyped(kls.__init__)
+        kls.__init__ = init
+        return kls
+    else:
+        raise ValueError(
+            "jaxtyped may only be added as a class decorator to dataclasses"
+        )
 
 
-@jaxtyped
-def _check_dataclass_annotations(self, typechecker):
-    for field in dataclasses.fields(self):
-        for kls in self.__class__.__mro__:
-            try:
-                annotation = kls.__annotations__[field.name]
-            except KeyError:
-                pass
-            else:
-                break
+# It'd be lovely if we could handle arbitrary descriptors, and not just the builtin
+# ones. Unfortunately that means returning a class instance with a __get__ method,
+# and that turns out to break loads of other things. See beartype issue #211 and
+# jaxtyping issue #71.
+def _wrap_classmethod(fn):
+    return classmethod(jaxtyped(fn.__func__))
+
+
+def _wrap_staticmethod(fn):
+    return staticmethod(jaxtyped(fn.__func__))
+
+
+def _lazily_wrapped(accessor):
+    # Defers building the jaxtyped wrapper until the accessor is first called. Most
+    # properties only ever have their getter exercised, so eagerly wrapping the
+    # setter and deleter at decoration time is wasted work.
+    wrapped = None
+
+    def accessor_fn(*args, **kwargs):
+        nonlocal wrapped
+        if wrapped is None:
+            wrapped = jaxtyped(accessor)
+        return wrapped(*args, **kwargs)
+
+    _fast_wraps(accessor_fn, accessor)
+    return accessor_fn
+
+
+def _wrap_property(fn):
+    # `fget` is wrapped eagerly: it is nearly always present and is the hot accessor,
+    # so it shouldn't pay for an extra laziness frame on every access.
+    if fn.fget is None:
+        fget = None
+    else:
+        fget = jaxtyped(fn.fget)
+    if fn.fset is None:
+        fset = None
+    else:
+        fset = _lazily_wrapped(fn.fset)
+    if fn.fdel is None:
+        fdel = None
+    else:
+        fdel = _lazily_wrapped(fn.fdel)
+    return property(fget=fget, fset=fset, fdel=fdel)
+
+
+# The body of the wrapper that `_wrap_function` builds around each decorated
+# function. Where possible the wrapper is codegen'd with the same parameter list as
+# the function it wraps (the same specialisation trick `dataclasses` uses for
+# `__init__`), so that calls forward arguments directly instead of packing them into
+# an args tuple and kwargs dict. All internal names are prefixed to keep them out of
+# the way of parameter names.
+_wrapper_template = """def wrapped_fn({params}):
+    __jaxtyping_state = __jaxtyping_get_memo_state(None)
+    if __jaxtyping_state is None:
+        __jaxtyping_state = ([], [])
+        __jaxtyping_set_memo_state(__jaxtyping_state)
+    __jaxtyping_memo_stack, __jaxtyping_frame_pool = __jaxtyping_state
+    __jaxtyping_pop = __jaxtyping_memo_stack.pop
+    __jaxtyping_recycle = __jaxtyping_frame_pool.append
+    __jaxtyping_memo_stack.append(
+        __jaxtyping_frame_pool.pop() if __jaxtyping_frame_pool else ({{}}, {{}}, {{}})
+    )
+    try:
+        return __jaxtyping_fn({call})
+    finally:
+        __jaxtyping_frame = __jaxtyping_pop()
+        __jaxtyping_frame[0].clear()
+        __jaxtyping_frame[1].clear()
+        __jaxtyping_frame[2].clear()
+        __jaxtyping_recycle(__jaxtyping_frame)
+"""
+
+
+def _specialised_wrapper(fn):
+    # Only specialise when the signature is exact. `inspect.signature` follows
+    # `__wrapped__` (and honours `__signature__`), so for a wrapper whose real call
+    # surface is wider than its advertised signature -- e.g. a `functools.wraps`
+    # wrapper adding a keyword option -- the codegen'd wrapper would reject calls
+    # that the wrapper itself accepts. Such callables take the generic
+    # `*args, **kwargs` path instead; plain functions still specialise.
+    if hasattr(fn, "__wrapped__") or hasattr(fn, "__signature__"):
+        return None
+    try:
+        signature = inspect.signature(fn)
+    except (TypeError, ValueError):
+        return None
+    namespace = {
+        "__jaxtyping_fn": fn,
+        "__jaxtyping_get_memo_state": _get_memo_state,
+        "__jaxtyping_set_memo_state": _set_memo_state,
+    }
+    params = []
+    call = []
+    positional_only = False
+    star = False
+    for i, param in enumerate(signature.parameters.values()):
+        name = param.name
+        if name.startswith("__jaxtyping"):  # would shadow our internal names
+            return None
+        if param.kind is inspect.Parameter.POSITIONAL_ONLY:
+            positional_only = True
+            piece = name
+            call.append(name)
         else:
+            if positional_only:
+                params.append("/")
+                positional_only = False
+            if param.kind is inspect.Parameter.POSITIONAL_OR_KEYWORD:
+                piece = name
+                call.append(name)
+            elif param.kind is inspect.Parameter.VAR_POSITIONAL:
+                star = True
+                piece = "*" + name
+                call.append("*" + name)
+            elif param.kind is inspect.Parameter.KEYWORD_ONLY:
+                if not star:
+                    params.append("*")
+                    star = True
+                piece = name
+                call.append(f"{name}={name}")
+            else:  # VAR_KEYWORD
+                piece = "**" + name
+                call.append("**" + name)
+        if param.default is not inspect.Parameter.empty:
+            default_name = f"__jaxtyping_default_{i}"
+            namespace[default_name] = param.default
+            piece = f"{piece}={default_name}"
+        params.append(piece)
+    if positional_only:
+        params.append("/")
+    source = _wrapper_template.format(params=", ".join(params), call=", ".join(call))
+    exec(source, namespace)
+    return namespace["wrapped_fn"]
+
+
+def _is_compiled_callable(fn):
+    # Checked by name rather than by import, since neither Numba nor JAX need be
+    # installed. Wrapping a Numba dispatcher or a jit'd JAX function would put a
+    # Python frame (and a memo push/pop) around every call into compiled code, where
+    # the wrapper can cost far more than the kernel itself -- and the annotations
+    # were already checked when the underlying function was traced/compiled.
+    tp = type(fn)
+    module = tp.__module__
+    if tp.__name__ == "CPUDispatcher" and module.startswith("numba"):
+        return True
+    if tp.__name__ in ("PjitFunction", "JitWrapped") and module.startswith(
+        ("jax", "jaxlib")
+    ):
+        return True
+    return False
+
+
+def _wrap_function(fn):
+    if getattr(fn, "__jaxtyped_wrapped__", False):
+        return fn
+    if _is_compiled_callable(fn):
+        return fn
+
+    wrapped_fn = _specialised_wrapper(fn)
+    if wrapped_fn is not None:
+        _fast_wraps(wrapped_fn, fn)
+        wrapped_fn.__jaxtyped_wrapped__ = True
+        return wrapped_fn
+
+    def wrapped_fn(*args, **kwargs):
+        state = _get_memo_state(None)
+        if state is None:
+            state = ([], [])
+            _set_memo_state(state)
+        memo_stack, frame_pool = state
+        # Bind the methods as locals up front, so that the post-call path -- in
+        # particular the `finally` block -- is free of attribute lookups.
+        pop = memo_stack.pop
+        recycle = frame_pool.append
+        memo_stack.append(frame_pool.pop() if frame_pool else ({}, {}, {}))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # The isinstance path in `_array_types` may have swapped the top frame
+            # out for a new tuple, so recycle whatever we pop, not what we pushed.
+            frame = pop()
+            frame[0].clear()
+            frame[1].clear()
+            frame[2].clear()
+            recycle(frame)
+
+    _fast_wraps(wrapped_fn, fn)
+    wrapped_fn.__jaxtyped_wrapped__ = True
+    return wrapped_fn
+
+
+_handlers = {
+    types.FunctionType: _wrap_function,
+    classmethod: _wrap_classmethod,
+    staticmethod: _wrap_staticmethod,
+    property: _wrap_property,
+    type: _wrap_class,
+}
+
+
+def _make_field_check(name, annotation, typechecker):
+    def typecheck(value):
+        pass
+
+    # Rename the parameter after the field, so that the typechecker's error messages
+    # refer to the field by name. The function gets a fresh empty global namespace
+    # (rather than this module's) since some typecheckers -- e.g. recent beartype --
+    # treat functions with jaxtyping's own globals as internal and skip them.
+    code = typecheck.__code__.replace(co_varnames=(name,))
+    typecheck = types.FunctionType(code, {}, "typecheck")
+    typecheck.__annotations__ = {name: annotation}
+    return typechecker(typecheck)
+
+
+def _build_field_checks(kls, typechecker):
+    # Resolve annotations across the whole MRO up front, rather than walking the MRO
+    # once per field.
+    resolved = {}
+    for base in reversed(kls.__mro__):
+        resolved.update(base.__dict__.get("__annotations__", {}))
+    checks = []
+    for field in dataclasses.fields(kls):
+        try:
+            annotation = resolved[field.name]
+        except KeyError:
             raise TypeError
         if isinstance(annotation, str):
             # Don't support stringified annotations. These are basically impossible to
@@ -163,23 +404,46 @@ def _check_dataclass_annotations(self, typechecker):
                 # This was fixed in Equinox in
                 # https://github.com/patrick-kidger/equinox/pull/543
                 continue
-        try:
-            value = getattr(self, field.name)  # noqa: F841
-        except AttributeError:
-            continue  # allow uninitialised fields, which are allowed on dataclasses
+        check = _make_field_check(field.name, annotation, typechecker)
+        checks.append((operator.attrgetter(field.name), check))
+    return tuple(checks)
 
-        # Dynamic `exec` to get a custom parameter name.
-        exec(
-            textwrap.dedent(
-                f"""
-        @typechecker
-        def typecheck({field.name}: annotation):
-            pass
 
-        typecheck(value)
-        """
-            )
-        )
+def _get_field_checks(kls, typechecker):
+    # Checks are usually built once at class-decoration time, in
+    # `_jaxtyped_typechecker`. An undecorated subclass inheriting the wrapped
+    # `__init__` (and possibly adding fields of its own) is handled lazily here, on
+    # its first construction.
+    cached = kls.__dict__.get("_jaxtyping_field_checks")
+    if cached is None or cached[0] is not typechecker:
+        cached = (typechecker, _build_field_checks(kls, typechecker))
+        kls._jaxtyping_field_checks = cached
+    return cached[1]
+
+
+def _check_dataclass_annotations(self, typechecker):
+    # The memo push/pop is inlined rather than applying `@jaxtyped` to this helper,
+    # which would cost an extra wrapper frame on every dataclass construction.
+    state = _get_memo_state(None)
+    if state is None:
+        state = ([], [])
+        _set_memo_state(state)
+    memo_stack, frame_pool = state
+    memo_stack.append(frame_pool.pop() if frame_pool else ({}, {}, {}))
+    try:
+        for get, check in _get_field_checks(type(self), typechecker):
+            try:
+                value = get(self)
+            except AttributeError:
+                # allow uninitialised fields, which are allowed on dataclasses
+                continue
+            check(value)
+    finally:
+        frame = memo_stack.pop()
+        frame[0].clear()
+        frame[1].clear()
+        frame[2].clear()
+        frame_pool.append(frame)
 
 
 def _jaxtyped_typechecker(typechecker):
@@ -199,27 +463,45 @@ def _jaxtyped_typechecker(typechecker):
     # typechecker is expected to probably be either `typeguard.typechecked`, or
     # `beartype.beartype`, or `None`.
 
+    if _disabled:
+        return lambda kls: kls
+
     if typechecker is None:
         typechecker = lambda x: x
 
     def _wrapper(kls):
-        assert inspect.isclass(kls)
-        if dataclasses.is_dataclass(kls):
+        assert isinstance(kls, type)
+        if hasattr(kls, "__dataclass_fields__"):
             # This does not check that the arguments passed to `__init__` match the
             # type annotations. There may be a custom user `__init__`, or a
             # dataclass-generated `__init__` used alongside
             # `equinox.field(converter=...)`
 
+            checks = _build_field_checks(kls, typechecker)
+            if len(checks) == 0:
+                # Nothing checkable (no fields, or only stringified annotations that
+                # we skip): don't make every construction pay for a wrapper.
+                return kls
+
             init = kls.__init__
+            kls._jaxtyping_field_checks = (typechecker, checks)
+
+            # Caches the top-level-`__init__` decision per instance class, as it is
+            # invariant for a given class. One cache per decorated class, not a
+            # global one: during a `super()` chain the same instance class passes
+            # through several of these wrappers, each needing its own answer.
+            _top_level_cache = weakref.WeakKeyDictionary()
 
-            @ft.wraps(init)
             def __init__(self, *args, **kwargs):
                 init(self, *args, **kwargs)
-                # `kls.__init__` is late-binding to the `__init__` function that we're
-                # in now. (Or to someone else's monkey-patch.) Either way, this checks
-                # that we're in the "top-level" `__init__`, and not one that is being
-                # called via `super()`. We don't want to trigger too early, before all
-                # fields have been assigned.
+                # This checks that we're in the "top-level" `__init__`, and not one
+                # that is being called via `super()`. We don't want to trigger too
+                # early, before all fields have been assigned.
+                #
+                # The decision is cached per instance class on its first
+                # construction and assumed fixed from then on: monkey-patching or
+                # re-decorating `__init__` after a class has been constructed once
+                # is not picked up.
                 #
                 # We're not checking `if self.__class__ is kls` because Equinox replaces
                 # the with a defrozen version of itself during `__init__`, so the check
@@ -227,9 +509,15 @@ def _jaxtyped_typechecker(typechecker):
                 #
                 # We're not doing this check by adding it to the end of the metaclass
                 # `__call__`, because Python doesn't allow you monkey-patch metaclasses.
-                if self.__class__.__init__ is kls.__init__:
+                cls = self.__class__
+                top_level = _top_level_cache.get(cls)
+                if top_level is None:
+                    top_level = cls.__init__ is kls.__init__
+                    _top_level_cache[cls] = top_level
+                if top_level:
                     _check_dataclass_annotations(self, typechecker)
 
+            _fast_wraps(__init__, init)
             kls.__init__ = __init__
         return kls
 
@@ -1,6 +1,18 @@
 import abc
+import dataclasses
+import functools as ft
+import os
+import subprocess
+import sys
 
-from jaxtyping import jaxtyped
+import jax
+import jax.numpy as jnp
+import pytest
+
+from jaxtyping import Array, Float, jaxtyped
+from jaxtyping._decorator import _jaxtyped_typechecker
+
+from .helpers import ParamError
 
 
 class M(metaclass=abc.ABCMeta):
@@ -75,3 +87,208 @@ def test_abstractmethod():
 def test_property():
     assert N().j1 == 3
     assert N().j2 == 4
+
+
+# The wrapper built around each decorated function is codegen'd to match the
+# function's own signature. Check the generated parameter handling, and that the
+# trickier callables fall back to the generic `*args, **kwargs` wrapper.
+
+
+def test_specialised_forwarding():
+    @jaxtyped
+    def f(a, b=2, *args, c, d=4, **kwargs):
+        return (a, b, args, c, d, kwargs)
+
+    assert f(1, c=3) == (1, 2, (), 3, 4, {})
+    assert f(1, 5, 6, 7, c=8, d=9, e=10) == (1, 5, (6, 7), 8, 9, {"e": 10})
+
+
+def test_specialised_positional_only():
+    @jaxtyped
+    def f(x, /, y):
+        return (x, y)
+
+    assert f(1, y=2) == (1, 2)
+    with pytest.raises(TypeError):
+        f(x=1, y=2)
+
+
+def test_specialised_mutable_default():
+    default = []
+
+    @jaxtyped
+    def f(x=default):
+        return x
+
+    assert f() is default
+
+
+def test_specialised_internal_name_fallback():
+    # A parameter that would shadow the wrapper's internal names falls back to the
+    # generic wrapper.
+    @jaxtyped
+    def f(__jaxtyping_fn):
+        return __jaxtyping_fn
+
+    assert f(3) == 3
+
+
+def test_specialised_uninspectable_fallback():
+    # `min` has no retrievable signature.
+    wrapped_min = jaxtyped(min)
+    assert wrapped_min(3, 1, 2) == 1
+
+
+def test_specialised_wrapped_fallback():
+    # A wrapper's real call surface can be wider than the signature it advertises
+    # via `__wrapped__`, so such callables must not be specialised.
+    def f(x):
+        return x
+
+    @ft.wraps(f)
+    def g(x, verbose=False):
+        return (x, verbose)
+
+    assert jaxtyped(g)(1, verbose=True) == (1, True)
+
+
+# The dataclass field checks (applied by the import hook via `_jaxtyped_typechecker`)
+# compile one checker per field at class-decoration time. In particular check that a
+# bad field value actually raises: the old exec-based implementation was silently
+# skipped by recent beartype releases, which ignore functions carrying jaxtyping's
+# own globals.
+
+
+def test_dataclass_field_check(typecheck):
+    @_jaxtyped_typechecker(typecheck)
+    @dataclasses.dataclass
+    class A:
+        x: int
+        y: str
+
+    A(1, "hi")
+    with pytest.raises(ParamError):
+        A(1, 2)
+
+
+def test_dataclass_field_consistency(typecheck):
+    @_jaxtyped_typechecker(typecheck)
+    @dataclasses.dataclass
+    class A:
+        x: Float[Array, " dim"]
+        y: Float[Array, " dim"]
+
+    A(jnp.zeros(3), jnp.zeros(3))
+    with pytest.raises(ParamError):
+        A(jnp.zeros(3), jnp.zeros(4))
+
+
+def test_dataclass_plain_subclass(typecheck):
+    @_jaxtyped_typechecker(typecheck)
+    @dataclasses.dataclass
+    class A:
+        x: int
+
+    # Not itself a dataclass: inherits the wrapped `__init__`, so its field checks
+    # are built lazily on first construction.
+    class B(A):
+        pass
+
+    B(1)
+    with pytest.raises(ParamError):
+        B("not an int")
+
+
+def test_dataclass_no_init(typecheck):
+    @_jaxtyped_typechecker(typecheck)
+    @dataclasses.dataclass(init=False)
+    class A:
+        x: int
+
+    a = A()  # uninitialised fields are allowed
+    a.x = 1
+
+
+# `JAXTYPING_DISABLE` and `python -O` are read once at import time, so these are
+# checked in subprocesses. (`raise`, not `assert`, in the program: `-O` strips
+# asserts.)
+_disable_program = """
+import dataclasses
+
+from jaxtyping import jaxtyped
+from jaxtyping._decorator import _jaxtyped_typechecker
+
+
+def f(x):
+    return x
+
+
+if (jaxtyped(f) is f) != {disabled}:
+    raise RuntimeError("jaxtyped")
+
+
+@dataclasses.dataclass
+class A:
+    x: int
+
+
+init = A.__init__
+_jaxtyped_typechecker(None)(A)
+if (A.__init__ is init) != {disabled}:
+    raise RuntimeError("_jaxtyped_typechecker")
+"""
+
+
+def _run_disable_program(disabled, flags=(), env=None):
+    program = _disable_program.format(disabled=disabled)
+    subprocess.run(
+        [sys.executable, *flags, "-c", program],
+        env=None if env is None else {**os.environ, **env},
+        check=True,
+    )
+
+
+def test_disable_env():
+    _run_disable_program(True, env={"JAXTYPING_DISABLE": "1"})
+    _run_disable_program(False, env={"JAXTYPING_DISABLE": "0"})
+
+
+def test_disable_optimize():
+    _run_disable_program(True, flags=("-O",))
+
+
+def test_jit_passthrough():
+    # jit'd functions are recognised by class name in `_is_compiled_callable`, so
+    # this breaks loudly if a jax release renames its jit wrapper class.
+    jitted = jax.jit(lambda x: x + 1)
+    assert jaxtyped(jitted) is jitted
+
+
+def test_property_setter_and_deleter(typecheck):
+    # Setters and deleters are wrapped lazily, on first use.
+    class A:
+        def _get_x(self):
+            return self._x
+
+        def _set_x(self, value: int):
+            self._x = value
+
+        def _del_x(self):
+            del self._x
+
+        x = jaxtyped(property(_get_x, typecheck(_set_x), _del_x))
+
+    a = A()
+    a.x = 3
+    assert a.x == 3
+    with pytest.raises(ParamError):
+        a.x = "not an int"
+    # The wrapper is cached after the first assignment; later assignments must
+    # still be checked.
+    a.x = 4
+    assert a.x == 4
+    with pytest.raises(ParamError):
+        a.x = "still not an int"
+    del a.x
+    with pytest.raises(AttributeError):
+        a.x